@@ -0,0 +1,35 @@
+import httpx
+import orjson
+import pytest
+from diskcache import Cache
+
+import groq_llm
+from rate_limiter import TokenBucket
+
+def gemini_response(text: str) -> dict:
+    return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+class FakeGemini:
+    """Answers groq_llm's HTTP calls through httpx.MockTransport instead of the network"""
+    def __init__(self):
+        self.requests = []
+        self.status = 200
+        self.texts = []  # one text per generateContent call, or the SSE deltas of a stream
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.status != 200:
+            return httpx.Response(self.status, request=request)
+        if request.url.path.endswith(":streamGenerateContent"):
+            body = b"".join(b"data: " + orjson.dumps(gemini_response(delta)) + b"\r\n\r\n" for delta in self.texts)
+            return httpx.Response(200, content=body, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(200, json=gemini_response(self.texts.pop(0)))
+
+@pytest.fixture
+def gemini(monkeypatch, tmp_path):
+    fake = FakeGemini()
+    monkeypatch.setattr(groq_llm, "_client", httpx.AsyncClient(transport=httpx.MockTransport(fake.handle)))
+    monkeypatch.setattr(groq_llm, "_response_cache", Cache(str(tmp_path / "llmcache")))
+    # Tests shouldn't wait on the real quota
+    monkeypatch.setattr(groq_llm, "_rate_limiter", TokenBucket(requests_per_minute=1e6, tokens_per_minute=1e9))
+    return fake
@@ -0,0 +1,83 @@
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+import os
+from typing import List
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+ONNX_DIR = os.getenv("EMBEDDER_ONNX_DIR", "./onnx_models/all-MiniLM-L6-v2")
+QUANTIZED_SUBDIR = "int8_per_channel"
+QUANTIZED_FILE = "model_quantized.onnx"
+# all-MiniLM-L6-v2 was trained with 256-token inputs; longer text is truncated (same as SentenceTransformer)
+MAX_SEQ_LENGTH = 256
+
+class Embedder:
+    def __init__(self, model_id: str = MODEL_ID, onnx_dir: str = ONNX_DIR):
+        """Sentence embedder running an int8-quantized ONNX export of `model_id` on ONNX Runtime.
+
+        Only onnxruntime and tokenizers are used at inference time; optimum is
+        needed just once to produce the quantized model.
+        """
+        quantized_dir = os.path.join(onnx_dir, QUANTIZED_SUBDIR)
+        if not os.path.exists(os.path.join(quantized_dir, QUANTIZED_FILE)):
+            self._export_and_quantize(model_id, onnx_dir, quantized_dir)
+        
+        self.tokenizer = Tokenizer.from_file(os.path.join(quantized_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=MAX_SEQ_LENGTH)
+        self.tokenizer.enable_padding()
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(quantized_dir, QUANTIZED_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        # Identifies what produced an embedding, so persisted vectors from another model,
+        # quantization or truncation length are never mixed with this one's
+        self.cache_tag = f"{model_id}:{QUANTIZED_SUBDIR}:{MAX_SEQ_LENGTH}"
+    
+    @staticmethod
+    def _export_and_quantize(model_id: str, export_dir: str, quantized_dir: str):
+        """One-time export to ONNX followed by dynamic int8 quantization (VNNI-friendly)"""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        
+        model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+        model.save_pretrained(export_dir)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(quantized_dir)
+        
+        quantizer = ORTQuantizer.from_pretrained(export_dir)
+        qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=True)
+        quantizer.quantize(save_dir=quantized_dir, quantization_config=qconfig)
+    
+    def encode_batch(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Embed texts into mean-pooled, L2-normalized float32 vectors (one row per text)"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        
+        # Batch texts of similar length together so little compute goes to padding tokens
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        embeddings = None
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            encodings = self.tokenizer.encode_batch([texts[i] for i in rows])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+            }
+            inputs = {name: value for name, value in inputs.items() if name in self._input_names}
+            token_embeddings = self.session.run(None, inputs)[0]
+            
+            # Mean pooling over real (non-padding) tokens
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if embeddings is None:
+                embeddings = np.empty((len(texts), pooled.shape[1]), dtype=np.float32)
+            # Scatter back to the caller's order
+            embeddings[rows] = pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+        
+        return embeddings
@@ -1,20 +1,87 @@
-from PyPDF2 import PdfReader
+import pymupdf
 from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Tuple
 import pytesseract
 import io
+import os
+import tempfile
+import threading
 
-# Set path to Tesseract
-pytesseract.pytesseract.tesseract_cmd = r'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+# Set path to Tesseract on Windows; elsewhere the binary is looked up on PATH
+if os.name == "nt":
+    pytesseract.pytesseract.tesseract_cmd = r'C:\\Program Files\\Tesseract-OCR\\tesseract.exe'
+# LSTM engine only; faster than the legacy + LSTM combination
+TESSERACT_CONFIG = '--oem 1'
+# Resolution used when rendering a page with no text layer for OCR
+OCR_DPI = 200
+
+# Bump whenever extracted text changes for the same input, so cached extractions are not reused
+EXTRACTOR_VERSION = 2
+
+# PDFs with fewer pages than this are extracted in-process; the pool only pays off for big documents
+PARALLEL_PAGE_THRESHOLD = 64
+
+_page_pool: Optional[ProcessPoolExecutor] = None
+# Extraction runs in asyncio.to_thread workers; two large PDFs at once must not each create a pool
+_page_pool_lock = threading.Lock()
+
+def _get_page_pool() -> ProcessPoolExecutor:
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return _page_pool
+
+def _page_text(page) -> str:
+    text = page.get_text("text")
+    if text.strip():
+        return text
+    # No text layer: only a page with images can be a scan worth rendering and OCRing
+    # (blank separator pages are skipped)
+    if not page.get_images():
+        return ""
+    pix = page.get_pixmap(dpi=OCR_DPI)
+    image = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+    try:
+        return pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
+    except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError) as e:
+        # OCR is best-effort: lose this page's text rather than the whole document
+        print(f"[WARN] OCR failed on page {page.number + 1}: {e}")
+        return ""
+
+def _extract_page_range(args: Tuple[str, int, int]) -> List[str]:
+    """Worker: extract text for pages [start, end) of the PDF at `path`"""
+    path, start, end = args
+    with pymupdf.open(path, filetype="pdf") as doc:
+        return [_page_text(doc[i]) for i in range(start, end)]
+
+def _extract_pdf_pages(file_bytes: bytes) -> List[str]:
+    with pymupdf.open(stream=file_bytes, filetype="pdf") as doc:
+        num_pages = doc.page_count
+        if num_pages < PARALLEL_PAGE_THRESHOLD:
+            return [_page_text(page) for page in doc]
+
+    # Workers read one shared temp file instead of each being sent a pickled copy of the PDF
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(file_bytes)
+    try:
+        # One contiguous page range per worker, so each worker parses the file once
+        workers = os.cpu_count() or 1
+        step = -(-num_pages // workers)
+        ranges = [(f.name, start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+        pages = []
+        for texts in _get_page_pool().map(_extract_page_range, ranges):
+            pages.extend(texts)
+        return pages
+    finally:
+        os.unlink(f.name)
 
 def extract_text_from_file(filename: str, file_bytes: bytes) -> str:
     text = ""
     if filename.endswith(".pdf"):
-        reader = PdfReader(io.BytesIO(file_bytes))
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
+        text = "".join(page_text + "\n" for page_text in _extract_pdf_pages(file_bytes) if page_text)
     elif filename.endswith((".png", ".jpg", ".jpeg")):
         image = Image.open(io.BytesIO(file_bytes))
-        text += pytesseract.image_to_string(image)
+        text += pytesseract.image_to_string(image, config=TESSERACT_CONFIG)
     return text
@@ -16,11 +16,94 @@
 #     )
 #     return response.choices[0].message.content.strip()
 import os
-import requests
+import orjson
+import hashlib
+import httpx
+from diskcache import Cache
+from rate_limiter import TokenBucket
+from typing import AsyncIterator, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 GEMINI_API_KEY = os.getenv("GROQ_API_KEY")
+GEMINI_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
+GEMINI_STREAM_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:streamGenerateContent"
+
+# Provider quota; every network call takes from it first. The defaults are Gemini 2.0 Flash's
+# free tier, so an unconfigured key is paced instead of hitting 429s; raise them on paid tiers
+_rate_limiter = TokenBucket(
+    requests_per_minute=float(os.getenv("LLM_RPM", "15")),
+    tokens_per_minute=float(os.getenv("LLM_TPM", "1000000"))
+)
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text
+    return len(text) // 4 + 1
+
+# Completed responses keyed by prompt hash; identical prompts skip the network entirely
+_response_cache = Cache(os.getenv("LLM_CACHE_DIR", "/tmp/llmcache"))
+
+# Marker the streamed answer prompt asks the model to finish with; generation is cut off once seen
+ANSWER_STOP = "### End"
+
+# Prompt templates, filled with str.format_map so nothing is rebuilt per call
+SUMMARY_PROMPT = "Summarize this:\n\n{text}"
+# The answer prompts share one system instruction and start with the document, so every
+# question about the same document sends an identical prefix the provider can cache.
+# Anything that varies per question or per call style goes after the context.
+ANSWER_SYSTEM = "You are an AI document analyzer. Based on the documents provided, answer the user's question accurately."
+ANSWER_PROMPT = """Documents:
+{context}
+
+Question: {question}
+Answer:"""
+ANSWER_STREAM_PROMPT = """Documents:
+{context}
+
+Question: {question}
+When the answer is complete, write """ + ANSWER_STOP + """ on its own line.
+Answer:"""
+ANSWER_BATCH_PROMPT = """Documents:
+{context}
+
+Questions:
+{questions}
+
+Answer each question. Respond with a JSON object of the form {{"answers": [...]}} containing exactly {count} strings: one answer per question, in the same order."""
+SCENARIO_PROMPT = """Based on the document below, simulate the effect of this change:
+
+Document:
+{context}
+
+Scenario:
+{scenario}
+
+Explain how the claim decision would change with this scenario."""
+
+# The key goes in a header, not the query string, so it never appears in URLs (httpx error messages, logs)
+_JSON_HEADERS = {"Content-Type": "application/json", "x-goog-api-key": GEMINI_API_KEY or ""}
+_STREAM_PARAMS = {"alt": "sse"}
+
+# Shared async client so concurrent calls reuse pooled keep-alive connections
+# (one TLS handshake per connection, not per call). Opened/closed by the FastAPI lifespan in main.py.
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=10.0)
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+_client: Optional[httpx.AsyncClient] = None
+
+async def open_client():
+    _get_client()
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    return _client
 
 
 # def answer_question(context: str, question: str) -> str:
@@ -38,41 +121,118 @@ GEMINI_API_KEY = os.getenv("GROQ_API_KEY")
 #         temperature=0.2
 #     )
 #     return response.choices[0].message.content.strip()
-def gemini_call(prompt):
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
-    headers = {"Content-Type": "application/json"}
-    params = {"key": GEMINI_API_KEY}
-    data = {
-        "contents": [
-            {"parts": [{"text": prompt}]}
-        ]
-    }
-    r = requests.post(url, headers=headers, params=params, json=data)
+def _prompt_key(prompt: str, kind: str = "call", system: Optional[str] = None) -> str:
+    digest = hashlib.sha256(f"{system or ''}\0{prompt}".encode()).hexdigest()
+    return f"{kind}:{digest}"
+
+def _payload(prompt: str, json_output: bool = False, system: Optional[str] = None) -> bytes:
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    if system:
+        payload["systemInstruction"] = {"parts": [{"text": system}]}
+    if json_output:
+        payload["generationConfig"] = {"responseMimeType": "application/json"}
+    return orjson.dumps(payload)
+
+async def _gemini_request(prompt: str, json_output: bool = False, system: Optional[str] = None) -> str:
+    await _rate_limiter.acquire(_estimate_tokens(prompt) + _estimate_tokens(system or ""))
+    r = await _get_client().post(GEMINI_URL, headers=_JSON_HEADERS, content=_payload(prompt, json_output, system))
     r.raise_for_status()
-    return r.json()["candidates"][0]["content"]["parts"][0]["text"]
-def generate_summary(text: str) -> str:
-    return gemini_call(f"Summarize this:\n\n{text}")
-def answer_question(context: str, question: str) -> str:
-    prompt = f"""You are an AI document analyzer. Based on the documents below, answer the user's question accurately:
-
-Documents:
-{context}
-
-Question: {question}
-Answer:"""
-    return gemini_call(prompt)
-
-def simulate_scenario(context: str, scenario: str) -> str:
-    prompt = f"""Based on the document below, simulate the effect of this change:
-
-Document:
-{context}
-
-Scenario:
-{scenario}
-
-Explain how the claim decision would change with this scenario."""
-    return gemini_call(prompt)
+    text = orjson.loads(r.content)["candidates"][0]["content"]["parts"][0]["text"]
+    _rate_limiter.consume(_estimate_tokens(text))
+    return text
+
+async def gemini_call(prompt, system: Optional[str] = None):
+    key = _prompt_key(prompt, system=system)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    text = await _gemini_request(prompt, system=system)
+    _response_cache.set(key, text)
+    return text
+async def gemini_stream(prompt: str, stop: Optional[str] = None, system: Optional[str] = None) -> AsyncIterator[str]:
+    """Yield text deltas as Gemini generates them (SSE).
+
+    If `stop` is given, output is cut at the first occurrence and the
+    connection is closed so the model stops generating.
+    """
+    await _rate_limiter.acquire(_estimate_tokens(prompt) + _estimate_tokens(system or ""))
+    pending = ""
+    async with _get_client().stream("POST", GEMINI_STREAM_URL, headers=_JSON_HEADERS, params=_STREAM_PARAMS, content=_payload(prompt, system=system)) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = orjson.loads(line[len("data:"):])
+            candidates = chunk.get("candidates") or [{}]
+            parts = candidates[0].get("content", {}).get("parts", [])
+            delta = "".join(part.get("text", "") for part in parts)
+            _rate_limiter.consume(len(delta) // 4)
+            if stop is None:
+                if delta:
+                    yield delta
+                continue
+            pending += delta
+            cut = pending.find(stop)
+            if cut != -1:
+                if cut:
+                    yield pending[:cut]
+                return
+            # Hold back a tail that could be the start of a stop marker split across chunks
+            split = len(pending) - (len(stop) - 1)
+            if split > 0:
+                yield pending[:split]
+                pending = pending[split:]
+    if pending:
+        yield pending
+async def generate_summary(text: str) -> str:
+    return await gemini_call(SUMMARY_PROMPT.format_map({"text": text}))
+async def answer_question(context: str, question: str) -> str:
+    prompt = ANSWER_PROMPT.format_map({"context": context, "question": question})
+    return await gemini_call(prompt, system=ANSWER_SYSTEM)
+
+async def answer_question_streamed(context: str, question: str) -> str:
+    """Like answer_question, but streams and stops as soon as the model signals the answer is done"""
+    prompt = ANSWER_STREAM_PROMPT.format_map({"context": context, "question": question})
+    key = _prompt_key(prompt, kind="stream", system=ANSWER_SYSTEM)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    parts = []
+    async for delta in gemini_stream(prompt, stop=ANSWER_STOP, system=ANSWER_SYSTEM):
+        parts.append(delta)
+    answer = "".join(parts).strip()
+    _response_cache.set(key, answer)
+    return answer
+
+async def answer_questions_batch(context: str, questions: List[str]) -> List[str]:
+    """Answer all questions in one request, so the document context is sent and processed once.
+
+    Raises ValueError if the model's JSON doesn't contain one string per question.
+    """
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+    prompt = ANSWER_BATCH_PROMPT.format_map({"context": context, "questions": numbered, "count": len(questions)})
+    key = _prompt_key(prompt, kind="batch", system=ANSWER_SYSTEM)
+    cached = _response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    raw = await _gemini_request(prompt, json_output=True, system=ANSWER_SYSTEM)
+    try:
+        answers = orjson.loads(raw)["answers"]
+    except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+        raise ValueError(f"Malformed batched answer: {e}") from e
+    if not isinstance(answers, list) or len(answers) != len(questions) or not all(isinstance(a, str) for a in answers):
+        raise ValueError("Batched answer does not have one string per question")
+
+    # Only cached once validated, so a bad response is retried next time
+    _response_cache.set(key, answers)
+    return answers
+
+async def simulate_scenario(context: str, scenario: str) -> str:
+    prompt = SCENARIO_PROMPT.format_map({"context": context, "scenario": scenario})
+    return await gemini_call(prompt)
 # def simulate_scenario(context: str, scenario: str) -> str:
 #     prompt = f"""Based on the document below, simulate the effect of this change:
 
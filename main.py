@@ -1,16 +1,44 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from extract_text import extract_text_from_file
-from groq_llm import generate_summary, answer_question, simulate_scenario
-from typing import List
-import requests
+from extract_text import EXTRACTOR_VERSION, extract_text_from_file
+from embedder import Embedder
+from semantic_cache import SemanticAnswerCache
+from vector_db import VectorDatabase
+from collections import OrderedDict
+from diskcache import Cache
+from groq_llm import generate_summary, answer_question, answer_question_streamed, answer_questions_batch, simulate_scenario, open_client, close_client
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 import asyncio
+import hashlib
+import hmac
+import httpx
+import orjson
 import os
+import random
+import sys
+import time
 from datetime import datetime
 # from mangum import Mangum
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await open_client()
+    # Client for document downloads, kept separate from the LLM client's pool
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        limits=httpx.Limits(max_connections=100),
+        follow_redirects=True
+    )
+    yield
+    await app.state.http.aclose()
+    await close_client()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Allow frontend access
 app.add_middleware(
@@ -35,60 +63,346 @@ class HackRxRunRequest(BaseModel):
 class HackRxRunResponse(BaseModel):
     answers: List[str]
 
+# Max LLM calls in flight at once; shared across requests to respect provider rate limits
+MAX_CONCURRENT_LLM_CALLS = int(os.getenv("HACKRX_CONCURRENCY", "8"))
+_llm_semaphore = asyncio.Semaphore(MAX_CONCURRENT_LLM_CALLS)
+
+# Circuit breaker: after this many consecutive 429s, stop calling the LLM for a cool-down window
+CIRCUIT_BREAKER_THRESHOLD = 3
+CIRCUIT_BREAKER_COOLDOWN = 30  # seconds
+_circuit = {"consecutive_429": 0, "open_until": 0.0}
+
+# Embedder for document chunks and questions, loaded on the first hackrx request: the first
+# load may export the ONNX model (needs network), and /upload, /ask, /simulate never need it
+_embedder: Optional[Embedder] = None
+_embedder_lock = asyncio.Lock()
+
+# Answers reused for near-duplicate questions (cosine >= 0.95) about the same document
+_answer_cache = SemanticAnswerCache(threshold=0.95)
+# Every failure_answer() message starts with this; those are never cached
+FAILED_ANSWER_PREFIX = "Failed to answer"
+
+# RAG: each question is answered from its top-k retrieved chunks instead of the whole document
+RAG_TOP_K = 5
+# Per-document chunk indexes kept in memory (LRU); an evicted index is freed with its
+# VectorDatabase and rebuilt from the on-disk embedding cache when the document comes back
+MAX_DOCUMENT_INDEXES = 16
+_document_indexes: "OrderedDict[str, VectorDatabase]" = OrderedDict()
+
+# Extracted text is cached on disk keyed by the SHA-256 of the document bytes,
+# up to TEXT_CACHE_SIZE_LIMIT bytes (least recently stored entries are evicted first)
+CACHE_DIR = os.getenv("HACKRX_CACHE_DIR", "/tmp/cache")
+TEXT_CACHE_SIZE_LIMIT = int(os.getenv("HACKRX_TEXT_CACHE_SIZE_LIMIT", str(512 * 2 ** 20)))
+_text_cache = Cache(os.path.join(CACHE_DIR, "text"), size_limit=TEXT_CACHE_SIZE_LIMIT)
+
+def _text_cache_key(key: str) -> str:
+    # Versioned, so text from an older extractor is never served after it changes
+    return f"{key}:{EXTRACTOR_VERSION}"
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# url -> {"key", "etag", "last_modified"} from the last successful download, for conditional GETs
+_download_validators: Dict[str, Dict[str, Optional[str]]] = {}
+# url hash -> in-flight ingest, so concurrent requests for the same document share one download/extract
+_ingest_tasks: Dict[str, asyncio.Task] = {}
+
 API_KEY = os.getenv("HACKRX_API_KEY", "a8f2e613b3a3b9b825f96951bc7ed46ccded181d1c9c83205e6a395e92c71f56")  # replace with secure key or env var
+_API_KEY_BYTES = API_KEY.encode()
 
 def verify_token(request: Request):
     auth = request.headers.get("Authorization")
     if not auth or not auth.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
     token = auth.split(" ")[1]
-    if token != API_KEY:
+    # Constant-time comparison so response timing doesn't leak the key
+    if not hmac.compare_digest(token.encode(), _API_KEY_BYTES):
         raise HTTPException(status_code=403, detail="Invalid API key")
 
 @app.post("/hackrx/run", response_model=HackRxRunResponse)
 async def hackrx_run(request_data: HackRxRunRequest, auth=Depends(verify_token)):
     try:
-        # Download the document
-        pdf_response = requests.get(request_data.documents)
-        if pdf_response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to download document")
-
-        filename = request_data.documents.split("/")[-1].split("?")[0]
-        file_bytes = pdf_response.content
-        text = extract_text_from_file(filename, file_bytes)
+        doc_hash, index = await ingest_document(request_data.documents)
+        question_embeddings = await embed_questions(request_data.questions)
+        question_chunks = await retrieve_chunks(index, question_embeddings)
 
-        answers = []
-        for question in request_data.questions:
-            answer = await try_answer_with_retry(text, question)
-            answers.append(answer)
-            await asyncio.sleep(1)  # prevent hitting rate limits
+        answers = await answer_all(doc_hash, request_data.questions, question_embeddings, question_chunks)
 
         return {"answers": answers}
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to process: {str(e)}")
 
-async def try_answer_with_retry(context: str, question: str, max_retries: int = 3) -> str:
+@app.post("/hackrx/run/stream")
+async def hackrx_run_stream(request_data: HackRxRunRequest, auth=Depends(verify_token)):
+    """Like /hackrx/run, but streams one JSON line per question as soon as it is answered"""
+    try:
+        doc_hash, index = await ingest_document(request_data.documents)
+        question_embeddings = await embed_questions(request_data.questions)
+        question_chunks = await retrieve_chunks(index, question_embeddings)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to process: {str(e)}")
+
+    async def indexed_answer(index: int, question: str):
+        context = "\n\n".join(question_chunks[index])
+        answer = await cached_answer(doc_hash, context, question, question_embeddings[index], answer_fn=answer_question_streamed)
+        return index, answer
+
+    async def answer_lines():
+        tasks = [asyncio.create_task(indexed_answer(i, q)) for i, q in enumerate(request_data.questions)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, answer = await next_done
+                yield orjson.dumps({"index": index, "question": request_data.questions[index], "answer": answer}) + b"\n"
+        finally:
+            # Client went away or we are done; don't leave LLM calls running
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(answer_lines(), media_type="application/x-ndjson")
+
+async def ingest_document(url: str) -> Tuple[str, VectorDatabase]:
+    """Load a document's (content hash, chunk index), joining an in-flight ingest of the same URL if there is one"""
+    key = hashlib.sha256(url.encode()).hexdigest()
+    task = _ingest_tasks.get(key)
+    if task is None:
+        task = asyncio.create_task(load_document(url))
+        _ingest_tasks[key] = task
+        # Later requests hit the text/index caches; only concurrent ones need to share the task
+        task.add_done_callback(lambda _: _ingest_tasks.pop(key, None))
+    # Shield so one caller disconnecting doesn't cancel the ingest for everyone else
+    return await asyncio.shield(task)
+
+async def get_embedder() -> Embedder:
+    """The shared embedder, loading it (off the event loop) on first use"""
+    global _embedder
+    if _embedder is None:
+        async with _embedder_lock:
+            if _embedder is None:
+                _embedder = await asyncio.to_thread(Embedder)
+    return _embedder
+
+async def load_document(url: str) -> Tuple[str, VectorDatabase]:
+    key, text = await load_document_text(url)
+    embedder = await get_embedder()
+    # Chunking + embedding is CPU-bound as well
+    index = await asyncio.to_thread(get_document_index, key, text, embedder)
+    return key, index
+
+def get_document_index(doc_hash: str, text: str, embedder: Embedder) -> VectorDatabase:
+    """Return the chunk index for a document, building it on first use"""
+    index = _document_indexes.get(doc_hash)
+    if index is None:
+        # Brute-force mirror only: a single document is always searched exactly, so an HNSW
+        # graph would never be queried, and a Chroma collection would outlive LRU eviction
+        index = VectorDatabase(embedder=embedder, persistent=False, use_chroma=False)
+        index.add_document(text)
+        _document_indexes[doc_hash] = index
+        while len(_document_indexes) > MAX_DOCUMENT_INDEXES:
+            _document_indexes.popitem(last=False)
+    else:
+        _document_indexes.move_to_end(doc_hash)
+    return index
+
+async def load_document_text(url: str) -> Tuple[str, str]:
+    # Download the document (revalidated against the cache when possible)
+    key, file_bytes = await download_document(url)
+    if file_bytes is None and _text_cache_key(key) not in _text_cache:
+        # The cached text was evicted after the conditional GET went out; fetch the body after all
+        _download_validators.pop(url, None)
+        key, file_bytes = await download_document(url)
+
+    filename = url.split("/")[-1].split("?")[0]
+    # Extraction is CPU-bound; keep it off the event loop
+    text = await asyncio.to_thread(get_document_text, key, filename, file_bytes)
+    return key, text
+
+async def download_document(url: str) -> Tuple[str, Optional[bytearray]]:
+    """Download a document, returning its content hash and bytes.
+
+    If the server answers a conditional GET with 304, the bytes are None and
+    the hash of the previously downloaded copy is returned.
+    """
+    headers = {}
+    previous = _download_validators.get(url)
+    if previous and _text_cache_key(previous["key"]) in _text_cache:
+        if previous["etag"]:
+            headers["If-None-Match"] = previous["etag"]
+        if previous["last_modified"]:
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    async with app.state.http.stream("GET", url, headers=headers) as response:
+        if response.status_code == 304 and headers:
+            return previous["key"], None
+        if response.status_code != 200:
+            raise HTTPException(status_code=400, detail="Failed to download document")
+
+        # Read into a single growing buffer, hashing each chunk as it arrives,
+        # instead of holding httpx's copy of the body and hashing in a second pass
+        body = bytearray()
+        hasher = hashlib.sha256()
+        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+            body.extend(chunk)
+            hasher.update(chunk)
+
+    key = hasher.hexdigest()
+    _download_validators[url] = {
+        "key": key,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    }
+    return key, body
+
+@lru_cache(maxsize=64)
+def read_cached_text(key: str) -> str:
+    text = _text_cache.get(_text_cache_key(key))
+    if text is None:
+        # Raised, not returned, so lru_cache doesn't remember the miss
+        raise KeyError(key)
+    return text
+
+def get_document_text(key: str, filename: str, file_bytes: Optional[bytes]) -> str:
+    """Return extracted text for a document, extracting only on a cache miss"""
+    try:
+        return read_cached_text(key)
+    except KeyError:
+        if file_bytes is None:
+            raise
+
+    text = extract_text_from_file(filename, file_bytes)
+    _text_cache.set(_text_cache_key(key), text)
+    return text
+
+async def embed_questions(questions: List[str]):
+    """Embed all questions of a request in one batch"""
+    embedder = await get_embedder()
+    return await asyncio.to_thread(embedder.encode_batch, questions)
+
+async def retrieve_chunks(index: VectorDatabase, question_embeddings) -> List[List[str]]:
+    """Top-k document chunks for each question, found with one batched search"""
+    if not len(question_embeddings):
+        return []
+    hits = await asyncio.to_thread(index.search_by_embeddings, question_embeddings, RAG_TOP_K)
+    return [[hit['document'] for hit in question_hits] for question_hits in hits]
+
+async def cached_answer(doc_hash: str, context: str, question: str, question_embedding, answer_fn=answer_question) -> str:
+    """Answer from the semantic cache when a near-identical question was already answered"""
+    cached = _answer_cache.lookup(doc_hash, question_embedding)
+    if cached is not None:
+        return cached
+    answer = await bounded_answer(context, question, answer_fn=answer_fn)
+    if not answer.startswith(FAILED_ANSWER_PREFIX):
+        _answer_cache.store(doc_hash, question_embedding, answer)
+    return answer
+
+async def answer_all(doc_hash: str, questions: List[str], question_embeddings, question_chunks: List[List[str]]) -> List[str]:
+    """Answer every question, asking the LLM about all cache misses in a single batched request.
+
+    The batched request's context is the union of the misses' retrieved chunks. Falls back
+    to one concurrent call per question, each with its own chunks, if the batched response
+    is unusable.
+    """
+    answers = [_answer_cache.lookup(doc_hash, emb) for emb in question_embeddings]
+    misses = [i for i, answer in enumerate(answers) if answer is None]
+    if not misses:
+        return answers
+
+    fresh = None
+    if len(misses) > 1:
+        # dict.fromkeys dedupes chunks retrieved for several questions, keeping rank order
+        context = "\n\n".join(dict.fromkeys(chunk for i in misses for chunk in question_chunks[i]))
+        try:
+            async with _llm_semaphore:
+                fresh = await call_llm_with_retry(answer_questions_batch, context, [questions[i] for i in misses])
+        except ValueError as e:
+            # Malformed batched JSON: the provider is fine, so one call per question is worth trying
+            print(f"[WARN] Batched answering failed, answering questions individually: {e}")
+        except Exception as e:
+            # Rate limited or failing even after retries; fanning out would only multiply the load
+            print(f"[ERROR] Batched answering failed: {describe_llm_error(e)}")
+            fresh = [failure_answer(e)] * len(misses)
+    if fresh is None:
+        # Answer the remaining questions concurrently; the semaphore and per-call backoff handle rate limits
+        fresh = await asyncio.gather(*(bounded_answer("\n\n".join(question_chunks[i]), questions[i]) for i in misses))
+
+    for i, answer in zip(misses, fresh):
+        answers[i] = answer
+        if not answer.startswith(FAILED_ANSWER_PREFIX):
+            _answer_cache.store(doc_hash, question_embeddings[i], answer)
+    return answers
+
+async def bounded_answer(context: str, question: str, answer_fn=answer_question) -> str:
+    async with _llm_semaphore:
+        return await try_answer_with_retry(context, question, answer_fn=answer_fn)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while the rate-limit circuit breaker is open"""
+
+async def call_llm_with_retry(call, *args, max_retries: int = 3):
+    """Await `call(*args)`, retrying rate limits, server errors and dropped connections.
+
+    Every 429 counts toward the circuit breaker; the last error is re-raised
+    once retries are exhausted or the error isn't worth retrying.
+    """
     backoff = 2
     for attempt in range(1, max_retries + 1):
+        if time.monotonic() < _circuit["open_until"]:
+            raise CircuitOpenError("the LLM provider is rate limiting")
         try:
-            return answer_question(context, question)
-        except Exception as e:
-            if "429" in str(e) and attempt < max_retries:
-                print(f"[WARN] Rate limit hit, retrying in {backoff} seconds... (Attempt {attempt})")
-                await asyncio.sleep(backoff)
-                backoff *= 2
-            else:
-                print(f"[ERROR] Failed after {attempt} attempts: {e}")
-                return "Failed to answer due to rate limiting or internal error."
-    return "Failed to answer due to unknown error."
+            result = await call(*args)
+            _circuit["consecutive_429"] = 0
+            return result
+        except httpx.HTTPStatusError as e:
+            status = e.response.status_code
+            if status == 429:
+                _circuit["consecutive_429"] += 1
+                if _circuit["consecutive_429"] >= CIRCUIT_BREAKER_THRESHOLD:
+                    _circuit["open_until"] = time.monotonic() + CIRCUIT_BREAKER_COOLDOWN
+                    print(f"[WARN] Repeated rate limits, pausing LLM calls for {CIRCUIT_BREAKER_COOLDOWN} seconds")
+            # Rate limits and server errors are worth retrying; other 4xx will fail again
+            if not (status == 429 or status >= 500) or attempt == max_retries:
+                raise
+            delay_cap = backoff
+            error = e
+        except httpx.TransportError as e:
+            if attempt == max_retries:
+                raise
+            # Timeouts / dropped connections are usually transient, retry quickly
+            delay_cap = 0.5
+            error = e
+
+        # Full jitter so concurrent retries don't hit the provider in lockstep
+        delay = random.uniform(0, delay_cap)
+        print(f"[WARN] {describe_llm_error(error)}; retrying in {delay:.1f} seconds... (Attempt {attempt})")
+        await asyncio.sleep(delay)
+        backoff *= 2
+
+def describe_llm_error(error: Exception) -> str:
+    """Loggable summary of an LLM call failure; httpx messages include the request URL, so they're never printed"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    if isinstance(error, httpx.HTTPError):
+        return type(error).__name__
+    return f"{type(error).__name__}: {error}"
+
+def failure_answer(error: Exception) -> str:
+    """The answer reported for a question the LLM couldn't answer"""
+    if isinstance(error, CircuitOpenError):
+        return "Failed to answer: the LLM provider is rate limiting, please retry shortly."
+    return "Failed to answer due to rate limiting or internal error."
+
+async def try_answer_with_retry(context: str, question: str, max_retries: int = 3, answer_fn=answer_question) -> str:
+    try:
+        return await call_llm_with_retry(answer_fn, context, question, max_retries=max_retries)
+    except CircuitOpenError as e:
+        return failure_answer(e)
+    except Exception as e:
+        print(f"[ERROR] Failed to answer: {describe_llm_error(e)}")
+        return failure_answer(e)
 
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     file_bytes = await file.read()
     filename = file.filename or "unknown_file"
     text = extract_text_from_file(filename, file_bytes)
-    summary = generate_summary(text)
+    summary = await generate_summary(text)
     return {
         "summary": summary,
         "full_text": text,
@@ -98,12 +412,25 @@ async def upload_file(file: UploadFile = File(...)):
 
 @app.post("/ask")
 async def ask_question(request: QuestionRequest):
-    answer = answer_question(request.context, request.question)
+    answer = await answer_question(request.context, request.question)
     return {"answer": answer}
 
 @app.post("/simulate")
 async def simulate(request: ScenarioRequest):
-    result = simulate_scenario(request.context, request.scenario)
+    result = await simulate_scenario(request.context, request.scenario)
     return {"result": result}
 
 # handler = Mangum(app)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools: faster event loop and HTTP parser than the pure-asyncio defaults
+    # (uvloop isn't available on Windows, where uvicorn's default loop is used instead)
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
+    )
@@ -0,0 +1,46 @@
+import asyncio
+import time
+
+class TokenBucket:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float):
+        """Proactive limiter for an API with request- and token-per-minute quotas.
+
+        Both budgets refill continuously; callers wait just long enough for
+        their request to fit instead of sleeping a fixed amount.
+        """
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        # Waiters queue up here so a big request isn't starved by a stream of small ones
+        self._lock = asyncio.Lock()
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+    
+    async def acquire(self, tokens: int):
+        """Wait until one request of about `tokens` tokens fits in the quota, then take it"""
+        # A request larger than the whole per-minute budget can only wait for a full bucket
+        tokens = min(tokens, self.tpm)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.rpm,
+                    (tokens - self._tokens) * 60 / self.tpm
+                )
+                await asyncio.sleep(wait)
+    
+    def consume(self, tokens: int):
+        """Charge tokens after the fact (e.g. the completion); the balance may go negative"""
+        self._refill()
+        self._tokens -= tokens
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+import numpy as np
+import time
+from typing import Dict, Optional
+
+class SemanticAnswerCache:
+    def __init__(self, threshold: float = 0.95, max_documents: int = 128,
+                 max_per_document: int = 256, ttl_seconds: float = 3600):
+        """Answers keyed by (document hash, question embedding).
+
+        A lookup hits when a previously answered question about the same
+        document has cosine similarity >= `threshold`. Embeddings must be
+        L2-normalized. Documents are evicted LRU, entries expire after `ttl_seconds`.
+        """
+        self.threshold = threshold
+        self.max_documents = max_documents
+        self.max_per_document = max_per_document
+        self.ttl_seconds = ttl_seconds
+        # doc_hash -> {"embeddings": (n, d) float32, "answers": [str], "created": (n,) float64}
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+    
+    def lookup(self, doc_hash: str, embedding: np.ndarray) -> Optional[str]:
+        entry = self._entries.get(doc_hash)
+        if entry is None:
+            return None
+        self._entries.move_to_end(doc_hash)
+        self._expire(entry)
+        if not entry["answers"]:
+            return None
+        
+        similarities = entry["embeddings"] @ np.asarray(embedding, dtype=np.float32)
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.threshold:
+            return entry["answers"][best]
+        return None
+    
+    def store(self, doc_hash: str, embedding: np.ndarray, answer: str):
+        row = np.asarray(embedding, dtype=np.float32)[None, :]
+        entry = self._entries.get(doc_hash)
+        if entry is None:
+            entry = {"embeddings": row, "answers": [answer], "created": np.array([time.monotonic()])}
+            self._entries[doc_hash] = entry
+        else:
+            entry["embeddings"] = np.vstack([entry["embeddings"], row])[-self.max_per_document:]
+            entry["answers"] = (entry["answers"] + [answer])[-self.max_per_document:]
+            entry["created"] = np.append(entry["created"], time.monotonic())[-self.max_per_document:]
+        self._entries.move_to_end(doc_hash)
+        
+        while len(self._entries) > self.max_documents:
+            self._entries.popitem(last=False)
+    
+    def _expire(self, entry: Dict):
+        fresh = entry["created"] >= time.monotonic() - self.ttl_seconds
+        if not fresh.all():
+            entry["embeddings"] = entry["embeddings"][fresh]
+            entry["answers"] = [a for a, keep in zip(entry["answers"], fresh) if keep]
+            entry["created"] = entry["created"][fresh]
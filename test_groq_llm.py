@@ -0,0 +1,74 @@
+import asyncio
+
+import orjson
+import pytest
+
+from groq_llm import ANSWER_STOP, answer_question_streamed, answer_questions_batch, gemini_stream
+
+def stream(prompt, stop=None):
+    async def run():
+        return [delta async for delta in gemini_stream(prompt, stop=stop)]
+    return asyncio.run(run())
+
+def test_stream_yields_every_delta_without_stop(gemini):
+    gemini.texts = ["Hello", ", ", "world"]
+    assert "".join(stream("hi")) == "Hello, world"
+
+def test_stop_marker_inside_one_chunk(gemini):
+    gemini.texts = ["The answer is 42.\n### End\nthis is never shown"]
+    assert "".join(stream("q", stop="### End")) == "The answer is 42.\n"
+
+def test_stop_marker_split_across_chunks(gemini):
+    gemini.texts = ["The answer", " is 42.\n##", "# E", "nd\nthis is never shown", "nor this"]
+    assert "".join(stream("q", stop="### End")) == "The answer is 42.\n"
+
+def test_partial_marker_that_never_completes_is_flushed(gemini):
+    gemini.texts = ["Use ##", "# headings", " and ### En", "ough said"]
+    assert "".join(stream("q", stop="### End")) == "Use ### headings and ### Enough said"
+
+def test_held_back_tail_is_released_at_end_of_stream(gemini):
+    gemini.texts = ["Done ###"]
+    assert "".join(stream("q", stop="### End")) == "Done ###"
+
+def test_streamed_answer_is_stripped_and_cached(gemini):
+    gemini.texts = ["  42 ", "\n" + ANSWER_STOP]
+    assert asyncio.run(answer_question_streamed("ctx", "q?")) == "42"
+    assert asyncio.run(answer_question_streamed("ctx", "q?")) == "42"
+    assert len(gemini.requests) == 1
+
+def batch(questions):
+    return asyncio.run(answer_questions_batch("ctx", questions))
+
+def test_batch_returns_answers_in_order(gemini):
+    gemini.texts = ['{"answers": ["one", "two"]}']
+    assert batch(["q1", "q2"]) == ["one", "two"]
+    # Asked for in JSON mode
+    assert orjson.loads(gemini.requests[0].content)["generationConfig"] == {"responseMimeType": "application/json"}
+
+def test_batch_top_level_array_is_rejected(gemini):
+    gemini.texts = ['["one", "two"]']
+    with pytest.raises(ValueError):
+        batch(["q1", "q2"])
+
+def test_batch_wrong_answer_count_is_rejected(gemini):
+    gemini.texts = ['{"answers": ["only one"]}']
+    with pytest.raises(ValueError):
+        batch(["q1", "q2"])
+
+def test_batch_non_string_answer_is_rejected(gemini):
+    gemini.texts = ['{"answers": ["one", 2]}']
+    with pytest.raises(ValueError):
+        batch(["q1", "q2"])
+
+def test_batch_invalid_json_is_rejected(gemini):
+    gemini.texts = ['{"answers": ["one", "tw']
+    with pytest.raises(ValueError):
+        batch(["q1", "q2"])
+
+def test_batch_rejected_response_is_not_cached(gemini):
+    gemini.texts = ['{"answers": []}', '{"answers": ["one", "two"]}']
+    with pytest.raises(ValueError):
+        batch(["q1", "q2"])
+    assert batch(["q1", "q2"]) == ["one", "two"]
+    assert batch(["q1", "q2"]) == ["one", "two"]
+    assert len(gemini.requests) == 2
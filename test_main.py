@@ -0,0 +1,73 @@
+import asyncio
+import time
+
+import pytest
+
+import main
+from groq_llm import answer_question
+
+@pytest.fixture(autouse=True)
+def closed_circuit(monkeypatch):
+    monkeypatch.setattr(main, "_circuit", {"consecutive_429": 0, "open_until": 0.0})
+    # No real backoff sleeps
+    monkeypatch.setattr(main.random, "uniform", lambda low, high: 0)
+
+def call(max_retries=3):
+    return asyncio.run(main.call_llm_with_retry(answer_question, "ctx", "q?", max_retries=max_retries))
+
+def test_breaker_opens_after_three_429s(gemini):
+    gemini.status = 429
+    with pytest.raises(main.httpx.HTTPStatusError):
+        call()
+    assert len(gemini.requests) == main.CIRCUIT_BREAKER_THRESHOLD
+    assert main._circuit["open_until"] > time.monotonic()
+
+def test_open_breaker_fails_fast_without_calling(gemini):
+    gemini.status = 429
+    with pytest.raises(main.httpx.HTTPStatusError):
+        call()
+    sent = len(gemini.requests)
+
+    with pytest.raises(main.CircuitOpenError):
+        call()
+    assert len(gemini.requests) == sent
+    answer = asyncio.run(main.try_answer_with_retry("ctx", "q?"))
+    assert answer.startswith(main.FAILED_ANSWER_PREFIX)
+    assert len(gemini.requests) == sent
+
+def test_breaker_closes_after_cooldown(gemini, monkeypatch):
+    gemini.status = 429
+    with pytest.raises(main.httpx.HTTPStatusError):
+        call()
+
+    monkeypatch.setitem(main._circuit, "open_until", time.monotonic() - 1)
+    gemini.status = 200
+    gemini.texts = ["42"]
+    assert call() == "42"
+    assert main._circuit["consecutive_429"] == 0
+
+def test_success_resets_the_429_count(gemini):
+    gemini.status = 429
+    with pytest.raises(main.httpx.HTTPStatusError):
+        call(max_retries=2)
+    assert main._circuit["consecutive_429"] == 2
+
+    gemini.status = 200
+    gemini.texts = ["42"]
+    assert call() == "42"
+    assert main._circuit["consecutive_429"] == 0
+    assert main._circuit["open_until"] == 0.0
+
+def test_client_errors_are_not_retried(gemini):
+    gemini.status = 400
+    with pytest.raises(main.httpx.HTTPStatusError):
+        call()
+    assert len(gemini.requests) == 1
+    assert main._circuit["consecutive_429"] == 0
+
+def test_server_errors_are_retried(gemini):
+    gemini.status = 503
+    with pytest.raises(main.httpx.HTTPStatusError):
+        call()
+    assert len(gemini.requests) == 3
+    assert main._circuit["open_until"] == 0.0
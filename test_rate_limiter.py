@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import rate_limiter
+from rate_limiter import TokenBucket
+
+class FakeClock:
+    """Stands in for time.monotonic/asyncio.sleep: sleeping advances the clock instantly"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limiter.asyncio, "sleep", clock.sleep)
+    return clock
+
+def acquire_all(bucket: TokenBucket, *token_counts: int):
+    async def run():
+        for tokens in token_counts:
+            await bucket.acquire(tokens)
+    asyncio.run(run())
+
+def test_requests_within_budget_do_not_wait(clock):
+    bucket = TokenBucket(requests_per_minute=60, tokens_per_minute=1000)
+    acquire_all(bucket, 100, 100, 100)
+    assert clock.sleeps == []
+
+def test_waits_for_the_next_request_slot(clock):
+    bucket = TokenBucket(requests_per_minute=2, tokens_per_minute=10_000)
+    acquire_all(bucket, 1, 1, 1)
+    # The third request waits for one request to refill: 60 / 2 seconds
+    assert clock.sleeps == [pytest.approx(30)]
+
+def test_waits_just_long_enough_for_tokens(clock):
+    bucket = TokenBucket(requests_per_minute=1000, tokens_per_minute=600)
+    acquire_all(bucket, 600, 300)
+    # 300 missing tokens at 10 tokens/s
+    assert clock.sleeps == [pytest.approx(30)]
+
+def test_consume_can_overdraw_and_delays_the_next_request(clock):
+    bucket = TokenBucket(requests_per_minute=1000, tokens_per_minute=600)
+    acquire_all(bucket, 100)
+    bucket.consume(800)
+    assert bucket._tokens == pytest.approx(-300)
+
+    acquire_all(bucket, 100)
+    # Pays back the 300-token overdraft plus the 100 requested
+    assert clock.sleeps == [pytest.approx(40)]
+
+def test_oversized_request_only_needs_a_full_bucket(clock):
+    bucket = TokenBucket(requests_per_minute=1000, tokens_per_minute=600)
+    acquire_all(bucket, 10_000)
+    assert clock.sleeps == []
+
+def test_refill_is_capped_at_the_per_minute_budget(clock):
+    bucket = TokenBucket(requests_per_minute=60, tokens_per_minute=600)
+    acquire_all(bucket, 600)
+    clock.now += 3600
+    acquire_all(bucket, 600, 60)
+    # An hour idle refills one minute's worth only, so the extra 60 tokens wait 6 seconds
+    assert clock.sleeps == [pytest.approx(6)]
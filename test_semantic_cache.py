@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import semantic_cache
+from semantic_cache import SemanticAnswerCache
+
+def unit(*values) -> np.ndarray:
+    vector = np.array(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "monotonic", lambda: now[0])
+    return now
+
+def test_hit_at_or_above_threshold():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("doc", unit(1, 0), "yes")
+    assert cache.lookup("doc", unit(1, 0)) == "yes"
+    assert cache.lookup("doc", unit(1, 0.2)) == "yes"  # cosine ~0.98
+
+def test_miss_below_threshold():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("doc", unit(1, 0), "yes")
+    assert cache.lookup("doc", unit(1, 0.5)) is None  # cosine ~0.89
+    assert cache.lookup("doc", unit(0, 1)) is None
+
+def test_answers_are_per_document():
+    cache = SemanticAnswerCache()
+    cache.store("a", unit(1, 0), "from a")
+    assert cache.lookup("b", unit(1, 0)) is None
+
+def test_best_match_wins():
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.store("doc", unit(1, 0.3), "close")
+    cache.store("doc", unit(1, 0), "exact")
+    assert cache.lookup("doc", unit(1, 0)) == "exact"
+
+def test_entries_expire_after_ttl(clock):
+    cache = SemanticAnswerCache(ttl_seconds=60)
+    cache.store("doc", unit(1, 0), "old")
+    clock[0] += 30
+    cache.store("doc", unit(0, 1), "new")
+
+    clock[0] += 40
+    assert cache.lookup("doc", unit(1, 0)) is None
+    assert cache.lookup("doc", unit(0, 1)) == "new"
+
+    clock[0] += 60
+    assert cache.lookup("doc", unit(0, 1)) is None
+
+def test_least_recently_used_document_is_evicted():
+    cache = SemanticAnswerCache(max_documents=2)
+    cache.store("a", unit(1, 0), "a")
+    cache.store("b", unit(1, 0), "b")
+    cache.lookup("a", unit(1, 0))  # touch a, so b is now the oldest
+    cache.store("c", unit(1, 0), "c")
+
+    assert cache.lookup("b", unit(1, 0)) is None
+    assert cache.lookup("a", unit(1, 0)) == "a"
+    assert cache.lookup("c", unit(1, 0)) == "c"
+
+def test_only_the_newest_answers_per_document_are_kept():
+    cache = SemanticAnswerCache(max_per_document=2)
+    cache.store("doc", unit(1, 0, 0), "first")
+    cache.store("doc", unit(0, 1, 0), "second")
+    cache.store("doc", unit(0, 0, 1), "third")
+
+    assert cache.lookup("doc", unit(1, 0, 0)) is None
+    assert cache.lookup("doc", unit(0, 1, 0)) == "second"
+    assert cache.lookup("doc", unit(0, 0, 1)) == "third"
@@ -0,0 +1,152 @@
+import hashlib
+import random
+import time
+
+import numpy as np
+import pytest
+
+from vector_db import VectorDatabase, _chunk_spans, quantize_int8
+
+class HashEmbedder:
+    """Deterministic stand-in for Embedder: a random unit vector seeded by the text"""
+    cache_tag = "hash"
+
+    def encode_batch(self, texts, batch_size=32):
+        rows = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+            rows.append(np.random.default_rng(seed).standard_normal(16))
+        embeddings = np.asarray(rows, dtype=np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+@pytest.fixture
+def db(tmp_path):
+    return VectorDatabase(embedding_cache_dir=str(tmp_path), embedder=HashEmbedder(),
+                          persistent=False, use_chroma=False)
+
+def assert_well_formed(text, spans, chunk_size, overlap):
+    assert all(0 < end - start <= chunk_size for start, end in spans)
+    # Nothing but whitespace before the first chunk or after the last one
+    assert not text[:spans[0][0]].strip()
+    assert not text[spans[-1][1]:].strip()
+    for (prev_start, prev_end), (start, end) in zip(spans, spans[1:]):
+        assert start > prev_start and end > prev_end  # every chunk makes progress
+        if start < prev_end:
+            assert prev_end - start <= overlap
+        else:
+            assert not text[prev_end:start].strip()  # no text skipped between chunks
+
+def sentences(first, n):
+    return " ".join(f"Sentence number {i} is right here." for i in range(first, first + n))
+
+def test_short_text_is_one_chunk(db):
+    assert db._split_text("Just one sentence.", chunk_size=100) == ["Just one sentence."]
+
+def test_chunks_are_slices_of_the_text(db):
+    text = sentences(0, 200)
+    chunks = db._split_text(text, chunk_size=300, overlap=80)
+    assert chunks == [text[start:end] for start, end in _chunk_spans(text, 300, 80)]
+
+def test_chunks_are_whole_sentences(db):
+    text = sentences(0, 200)
+    spans = _chunk_spans(text, 300, 80)
+    assert len(spans) > 1
+    assert_well_formed(text, spans, 300, 80)
+    for chunk in db._split_text(text, chunk_size=300, overlap=80):
+        assert chunk.startswith("Sentence number ")
+        assert chunk.endswith(".")
+
+def test_consecutive_chunks_overlap():
+    text = sentences(0, 200)
+    spans = _chunk_spans(text, 300, 80)
+    assert all(start < prev_end for (_, prev_end), (start, _) in zip(spans, spans[1:]))
+
+def test_no_overlap(db):
+    text = sentences(0, 100)
+    assert_well_formed(text, _chunk_spans(text, 300, 0), 300, 0)
+    assert " ".join(db._split_text(text, chunk_size=300, overlap=0)) == text
+
+def test_long_sentence_is_cut_to_chunk_size():
+    text = "Short start. " + "x" * 2500 + ". Short end."
+    spans = _chunk_spans(text, 1000, 200)
+    assert_well_formed(text, spans, 1000, 200)
+    assert max(end - start for start, end in spans) == 1000
+
+def test_paragraph_breaks_are_kept(db):
+    text = "\n\n".join(sentences(3 * i, 3) for i in range(20))
+    assert_well_formed(text, _chunk_spans(text, 400, 100), 400, 100)
+    assert any("\n\n" in chunk for chunk in db._split_text(text, chunk_size=400, overlap=100))
+
+def test_leader_dots_split_in_linear_time():
+    # Punctuation runs not followed by whitespace used to backtrack once per dot
+    text = "\n".join(f"Field {i}" + "." * 40 + f"value {i}" for i in range(10_000)) + " " + "." * 20_000 + "x"
+    started = time.perf_counter()
+    spans = _chunk_spans(text, 1000, 200)
+    assert time.perf_counter() - started < 1
+    assert_well_formed(text, spans, 1000, 200)
+
+def test_whitespace_only_text_is_kept_whole(db):
+    text = " \n\n " * 400
+    assert db._split_text(text, chunk_size=100) == [text]
+
+def test_random_text_respects_bounds():
+    rng = random.Random(7)
+    for _ in range(50):
+        words = []
+        for _ in range(rng.randint(50, 800)):
+            word = "".join(rng.choice("abcdefgh") for _ in range(rng.randint(1, rng.choice([8, 40, 1500]))))
+            words.append(word + rng.choice([" ", " ", ". ", "! ", "? ", "\n", "\n\n"]))
+        text = "".join(words)
+        chunk_size, overlap = rng.choice([(1000, 200), (300, 50), (120, 0)])
+        assert_well_formed(text, _chunk_spans(text, chunk_size, overlap), chunk_size, overlap)
+
+def test_quantize_int8_round_trip():
+    embeddings = np.random.default_rng(0).standard_normal((50, 384)).astype(np.float32)
+    codes, scales = quantize_int8(embeddings)
+    assert codes.dtype == np.int8 and scales.dtype == np.float32
+    assert np.abs(codes).max() == 127
+    # Rounding error is at most half a quantization step per element
+    assert np.all(np.abs(codes * scales[:, None] - embeddings) <= scales[:, None] / 2 + 1e-6)
+
+def test_quantize_int8_zero_row():
+    codes, scales = quantize_int8(np.zeros((1, 8), dtype=np.float32))
+    assert not codes.any()
+    assert scales[0] == 1
+
+def test_brute_force_search_ranks_exactly(db):
+    text = sentences(0, 300)
+    db.add_document(text, {"source": "test"})
+    chunks = db._split_text(text)
+    query = HashEmbedder().encode_batch([chunks[3]])
+
+    hits = db.search_by_embeddings(query, n_results=5)[0]
+    assert len(hits) == 5
+    assert hits[0]["document"] == chunks[3]
+    assert hits[0]["score"] == pytest.approx(1, abs=0.01)
+    scores = [hit["score"] for hit in hits]
+    assert scores == sorted(scores, reverse=True)
+
+    # Scores match float32 cosine similarity up to quantization error
+    exact = HashEmbedder().encode_batch(chunks) @ query[0]
+    assert scores == pytest.approx(sorted(exact, reverse=True)[:5], abs=0.02)
+
+def test_search_results_do_not_share_metadata(db):
+    db.add_document(sentences(0, 300), {"source": "test"})
+    hits = db.search_by_embeddings(HashEmbedder().encode_batch(["query"]), n_results=3)[0]
+    hits[0]["metadata"]["note"] = "annotated"
+    assert "note" not in hits[1]["metadata"]
+    assert all("note" not in metadata for metadata in db.doc_metadatas)
+
+def test_re_adding_a_document_is_a_no_op(db):
+    text = sentences(0, 300)
+    first_id = db.add_document(text)
+    assert db.add_document(text) == first_id
+    assert len(db.ids) == len(db._split_text(text))
+
+def test_delete_keeps_the_mirror_aligned(db):
+    db.add_document(sentences(0, 300))
+    victim = db.ids[2]
+    assert db.delete_document(victim)
+    assert victim not in db.ids
+    codes, scales, docs, metadatas = db._snapshot()
+    assert len(codes) == len(scales) == len(docs) == len(metadatas) == len(db.ids)
@@ -1,74 +1,398 @@
 import chromadb
 from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+from embedder import Embedder
+from diskcache import Cache
 import numpy as np
+import asyncio
+import hashlib
 import json
 import os
-from typing import List, Dict, Any, Optional
+import re
+import threading
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Tuple
 import uuid
 
+class EmbeddingBatcher:
+    def __init__(self, embedder: Embedder, max_batch: int = 32, max_wait_ms: float = 5):
+        """Coalesce concurrent single-text embed requests into one encode call.
+
+        The first request in a batch waits at most `max_wait_ms` for others to join.
+        """
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed one text, sharing the forward pass with concurrent callers"""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                embeddings = await asyncio.to_thread(
+                    self.embedder.encode_batch, [text for text, _ in batch], self.max_batch
+                )
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+# Bump whenever _split_text's output changes, so chunkings cached by older versions are not reused
+SPLITTER_VERSION = 2
+# Paragraph: a run of non-empty lines; sentence: up to ., ! or ? followed by whitespace.
+# The terminator only starts at the beginning of a punctuation run, so leader dots
+# ("Name.......John") are tried once instead of once per dot (quadratic backtracking)
+_PARAGRAPH = re.compile(r'[^\n]+(?:\n(?!\n)[^\n]+)*')
+_SENTENCE = re.compile(r'\S.*?(?:(?<![.!?])[.!?]+(?=\s|$)|$)', re.S)
+
+def _chunk_spans(text: str, chunk_size: int, overlap: int) -> List[Tuple[int, int]]:
+    """(start, end) offsets of _split_text's chunks.
+
+    Paragraphs, then sentences within them, are located in one pass over
+    `text`, and chunks are packed from the sentence offsets.
+    """
+    spans = []
+    for paragraph in _PARAGRAPH.finditer(text):
+        for sentence in _SENTENCE.finditer(text, paragraph.start(), paragraph.end()):
+            start, end = sentence.span()
+            # A single sentence longer than a chunk is cut into chunk-sized pieces
+            while end - start > chunk_size:
+                spans.append((start, start + chunk_size))
+                start += chunk_size
+            spans.append((start, end))
+    if not spans:
+        return []
+    
+    chunks = []
+    begin = 0  # index of the current chunk's first sentence
+    for i in range(1, len(spans) + 1):
+        if i < len(spans) and spans[i][1] - spans[begin][0] <= chunk_size:
+            continue
+        
+        # spans[begin:i] is full: it becomes one chunk
+        chunks.append((spans[begin][0], spans[i - 1][1]))
+        if i == len(spans):
+            break
+        
+        # Start the next chunk with trailing sentences (up to `overlap` chars) of this one
+        chunk_end = spans[i - 1][1]
+        next_begin = i
+        while (next_begin - 1 > begin
+               and chunk_end - spans[next_begin - 1][0] <= overlap
+               and spans[i][1] - spans[next_begin - 1][0] <= chunk_size):
+            next_begin -= 1
+        begin = next_begin
+    
+    return chunks
+
+# Up to this many chunks, an exact BLAS matrix product beats walking the HNSW graph
+BRUTE_FORCE_MAX_CHUNKS = 50_000
+# Rows dequantized per step during search; keeps the float32 scratch block cache-resident
+SQ_BLOCK_ROWS = 4096
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Scalar-quantize rows to int8 with a per-row scale, so row ~= codes * scale"""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+# PERSIST=0 keeps every collection in memory (no SQLite writes); otherwise it's stored in persist_directory
+PERSIST = os.getenv("PERSIST", "1") != "0"
+
+# Chunks embedded per ONNX Runtime call when indexing a document
+DOCUMENT_BATCH_SIZE = 64
+
+# Chunks of previously seen documents and the embedding of every chunk, keyed by content hash
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "/tmp/cache/embeddings")
+# Disk budget for each of the document and chunk caches; least recently stored entries are evicted past it
+EMBEDDING_CACHE_SIZE_LIMIT = int(os.getenv("EMBEDDING_CACHE_SIZE_LIMIT", str(2 ** 30)))
+
+@lru_cache(maxsize=None)
+def _open_cache(directory: str, size_limit: int) -> Cache:
+    """One diskcache handle per directory, shared by every VectorDatabase using it"""
+    return Cache(directory, size_limit=size_limit)
+
 class VectorDatabase:
-    def __init__(self, persist_directory: str = "./chroma_db"):
-        """Initialize vector database with ChromaDB and sentence transformers"""
+    def __init__(self, persist_directory: str = "./chroma_db", embedding_cache_dir: str = EMBEDDING_CACHE_DIR,
+                 collection_name: str = "documents", embedder: Optional[Embedder] = None,
+                 persistent: bool = PERSIST, use_chroma: bool = True):
+        """Initialize vector database with ChromaDB and the ONNX embedder.
+
+        Pass `embedder` to share one loaded model between several databases, and
+        `persistent=False` for throwaway corpora that shouldn't touch disk.
+        `use_chroma=False` keeps chunks only in the in-memory brute-force mirror:
+        for small, short-lived corpora that never need the HNSW index, and whose
+        memory is freed as soon as the database object is dropped.
+        """
         self.persist_directory = persist_directory
-        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.embedding_cache_dir = embedding_cache_dir
         
-        # Initialize sentence transformer model for embeddings
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+        # Initialize the int8 ONNX MiniLM embedder
+        self.embedding_model = embedder or Embedder()
+        # Embedding per (model, chunk text) BLAKE2b key, so repeated chunks are never re-embedded
+        self._chunk_embeddings = _open_cache(os.path.join(embedding_cache_dir, "chunks"), EMBEDDING_CACHE_SIZE_LIMIT)
+        self._chunk_key_prefix = self.embedding_model.cache_tag.encode() + b"\0"
+        # Chunk texts per document; their embeddings come from the chunk cache above
+        self._document_chunks = _open_cache(os.path.join(embedding_cache_dir, "documents"), EMBEDDING_CACHE_SIZE_LIMIT)
+        self._query_batcher = EmbeddingBatcher(self.embedding_model)
         
-        # Create or get collection
-        self.collection = self.client.get_or_create_collection(
-            name="documents",
-            metadata={"hnsw:space": "cosine"}
-        )
+        self.client = None
+        self.collection = None
+        if use_chroma:
+            if persistent:
+                self.client = chromadb.PersistentClient(path=persist_directory)
+            else:
+                # All EphemeralClients in a process share one store: collections live until deleted
+                self.client = chromadb.EphemeralClient()
+            
+            # Create or get collection. HNSW parameters only take effect when the
+            # collection is first created; an existing index keeps its settings.
+            self.collection = self.client.get_or_create_collection(
+                name=collection_name,
+                metadata={
+                    "hnsw:space": "cosine",
+                    "hnsw:M": 32,
+                    "hnsw:construction_ef": 128,
+                    "hnsw:search_ef": 64
+                }
+            )
+        
+        # In-memory mirror of the collection for brute-force search: one int8-quantized,
+        # L2-normalized row per chunk (384 B instead of 1536 B) plus its dequantization scale
+        self.ids: List[str] = []
+        self.docs: List[str] = []
+        self.doc_metadatas: List[Dict[str, Any]] = []
+        self.emb_codes = np.zeros((0, 0), dtype=np.int8)
+        self.emb_scales = np.zeros(0, dtype=np.float32)
+        self._pending_embeddings: List[Tuple[np.ndarray, np.ndarray]] = []
+        # Searches run in worker threads (asyncio.to_thread); guards the mirror against
+        # concurrent stacking/deleting. Adds only extend the lists and deletes replace them,
+        # so rows in a reader's snapshot stay valid after the lock is released.
+        self._mirror_lock = threading.Lock()
+        # doc_hash -> first chunk ID, so re-adding an identical document is a no-op
+        self._doc_hashes: Dict[str, str] = {}
+        self._load_matrix()
+    
+    def _load_matrix(self):
+        """Mirror the persisted collection into the in-memory matrix"""
+        if self.collection is None:
+            return
+        existing = self.collection.get(include=['embeddings', 'documents', 'metadatas'])
+        if len(existing['ids']):
+            self._append_rows(
+                existing['ids'],
+                existing['documents'],
+                existing['metadatas'] or [{} for _ in existing['ids']],
+                np.asarray(existing['embeddings'], dtype=np.float32)
+            )
+    
+    def _append_rows(self, ids: List[str], docs: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray):
+        block = quantize_int8(embeddings)
+        with self._mirror_lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                doc_hash = (metadata or {}).get('doc_hash')
+                if doc_hash:
+                    self._doc_hashes.setdefault(doc_hash, chunk_id)
+            self.ids.extend(ids)
+            self.docs.extend(docs)
+            self.doc_metadatas.extend(metadatas)
+            # Stacked lazily in _flush_pending(), so repeated adds don't copy the whole matrix each time
+            self._pending_embeddings.append(block)
+    
+    def _flush_pending(self):
+        """Stack pending blocks into the matrix; the caller holds _mirror_lock"""
+        if self._pending_embeddings:
+            blocks = self._pending_embeddings if not len(self.emb_codes) else [(self.emb_codes, self.emb_scales)] + self._pending_embeddings
+            self.emb_codes = np.ascontiguousarray(np.vstack([codes for codes, _ in blocks]))
+            self.emb_scales = np.concatenate([scales for _, scales in blocks])
+            self._pending_embeddings = []
+    
+    def _snapshot(self) -> Tuple[np.ndarray, np.ndarray, List[str], List[Dict[str, Any]]]:
+        """Return (int8 codes, per-row scales, chunk texts, metadatas) for the whole corpus, row-aligned"""
+        with self._mirror_lock:
+            self._flush_pending()
+            return self.emb_codes, self.emb_scales, self.docs, self.doc_metadatas
+    
+    def _scores(self, codes: np.ndarray, scales: np.ndarray, query_embeddings: np.ndarray) -> np.ndarray:
+        """Cosine similarity of each query against every row of `codes`, shape (queries, chunks)"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        # Memory traffic is the int8 codes; each float32 block is only a short-lived scratch copy
+        for start in range(0, len(codes), SQ_BLOCK_ROWS):
+            end = start + SQ_BLOCK_ROWS
+            block = codes[start:end].astype(np.float32)
+            scores[:, start:end] = (queries @ block.T) * scales[start:end]
+        return scores
     
     def add_document(self, text: str, metadata: Dict[str, Any] = None) -> str:
         """Add a document to the vector database"""
-        # Split text into chunks for better retrieval
-        chunks = self._split_text(text, chunk_size=1000, overlap=200)
+        doc_hash = hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+        if doc_hash in self._doc_hashes:
+            return self._doc_hashes[doc_hash]
         
-        # Generate embeddings for chunks
-        embeddings = self.embedding_model.encode(chunks)
+        # Chunk + embed, or reuse what was computed for this exact text before
+        chunks, embeddings = self._chunks_and_embeddings(doc_hash, text)
         
         # Prepare documents for insertion
-        ids = [str(uuid.uuid4()) for _ in chunks]
-        metadatas = [metadata or {} for _ in chunks] if metadata else [{} for _ in chunks]
+        # One random UUID per document; chunk IDs are derived from it (unique, and no urandom call per chunk)
+        base_id = uuid.uuid4().hex
+        ids = [f"{base_id}_{i}" for i in range(len(chunks))]
+        # Every chunk has identical metadata: share one dict (Chroma serializes it, never mutates it)
+        metadatas = [dict(metadata or {}, doc_hash=doc_hash)] * len(chunks)
         
         # Add to collection
-        self.collection.add(
-            embeddings=embeddings.tolist(),
-            documents=chunks,
-            metadatas=metadatas,
-            ids=ids
-        )
+        if self.collection is not None:
+            self.collection.add(
+                embeddings=embeddings.tolist(),
+                documents=chunks,
+                metadatas=metadatas,
+                ids=ids
+            )
+        self._append_rows(ids, chunks, metadatas, embeddings)
         
         return ids[0]  # Return first chunk ID as document ID
     
-    def search_similar(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar documents"""
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode([query])
+    def _chunks_and_embeddings(self, doc_hash: str, text: str, chunk_size: int = 1000,
+                               overlap: int = 200) -> Tuple[List[str], np.ndarray]:
+        """Split and embed `text`, reusing the cached chunking of this exact text and splitter config"""
+        key = f"{doc_hash}:{chunk_size}:{overlap}:{SPLITTER_VERSION}"
+        chunks = self._document_chunks.get(key)
+        if chunks is None:
+            # Split text into chunks for better retrieval
+            chunks = self._split_text(text, chunk_size=chunk_size, overlap=overlap)
+            self._document_chunks.set(key, chunks)
+        
+        # Generate embeddings for chunks; for a document seen before these are all cache hits
+        return chunks, self._embed_chunks(chunks)
+    
+    def _embed_chunks(self, chunks: List[str]) -> np.ndarray:
+        """Embed chunks, only running the model on texts not embedded before"""
+        keys = [self._chunk_key_prefix + hashlib.blake2b(chunk.encode(), digest_size=16).digest() for chunk in chunks]
+        texts = dict(zip(keys, chunks))  # also collapses duplicates within this document
+        
+        vectors: Dict[bytes, np.ndarray] = {}
+        for key in texts:
+            cached = self._chunk_embeddings.get(key)
+            if cached is not None:
+                vectors[key] = np.frombuffer(cached, dtype=np.float32)
         
-        # Search in collection
+        missing = [key for key in texts if key not in vectors]
+        if missing:
+            # Larger batches than queries: documents have many chunks
+            fresh = self.embedding_model.encode_batch([texts[key] for key in missing], batch_size=DOCUMENT_BATCH_SIZE)
+            for key, vector in zip(missing, fresh):
+                vectors[key] = vector
+                self._chunk_embeddings.set(key, vector.tobytes())
+        
+        return np.vstack([vectors[key] for key in keys])
+    
+    async def search_similar(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
+        """Search for similar documents.
+
+        Concurrent callers are micro-batched: their queries share one
+        embedding forward pass.
+        """
+        query_embedding = await self._query_batcher.embed(query)
+        results = await asyncio.to_thread(self.search_by_embeddings, query_embedding[None, :], n_results)
+        return results[0]
+    
+    def search_similar_batch(self, queries: List[str], n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        """Search for similar documents for several queries, embedding them in one pass"""
+        if not queries:
+            return []
+        
+        # Generate all query embeddings in a single batch
+        query_embeddings = self.embedding_model.encode_batch(queries)
+        return self.search_by_embeddings(query_embeddings, n_results)
+    
+    def search_by_embeddings(self, query_embeddings: np.ndarray, n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        """Search with precomputed query embeddings, one result list per row"""
+        if self.collection is None or len(self.ids) <= BRUTE_FORCE_MAX_CHUNKS:
+            return self._brute_force_search(query_embeddings, n_results)
+        
+        # Search in collection (Chroma accepts a batch of query embeddings)
         results = self.collection.query(
-            query_embeddings=query_embedding.tolist(),
+            query_embeddings=query_embeddings.tolist(),
             n_results=n_results,
             include=['documents', 'metadatas', 'distances']
         )
         
-        # Format results
+        # Format results, one list per query
         formatted_results = []
-        for i in range(len(results['documents'][0])):
-            formatted_results.append({
-                'document': results['documents'][0][i],
-                'metadata': results['metadatas'][0][i],
-                'distance': results['distances'][0][i]
-            })
+        for q in range(len(query_embeddings)):
+            hits = []
+            for i in range(len(results['documents'][q])):
+                hits.append({
+                    'document': results['documents'][q][i],
+                    'metadata': results['metadatas'][q][i],
+                    'distance': results['distances'][q][i]
+                })
+            formatted_results.append(hits)
+        
+        return formatted_results
+    
+    def _brute_force_search(self, query_embeddings: np.ndarray, n_results: int) -> List[List[Dict[str, Any]]]:
+        """Exact cosine search: one matrix product over the normalized corpus"""
+        codes, scales, docs, metadatas = self._snapshot()
+        if not len(codes):
+            return [[] for _ in range(len(query_embeddings))]
+        
+        scores = self._scores(codes, scales, query_embeddings)
+        k = min(n_results, scores.shape[1])
+        
+        # Top-k for every query at once: O(n) partition, then sort only the k survivors
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        
+        formatted_results = []
+        for rows, row_scores in zip(top.tolist(), top_scores.tolist()):
+            formatted_results.append([{
+                'document': docs[i],
+                # Chunks of a document share one metadata dict; hand out copies
+                'metadata': dict(metadatas[i] or {}),
+                'distance': 1 - score,
+                'score': score
+            } for i, score in zip(rows, row_scores)])
         
         return formatted_results
     
     def get_document_by_id(self, doc_id: str) -> Optional[Dict[str, Any]]:
         """Retrieve a specific document by ID"""
+        if self.collection is None:
+            if doc_id not in self.ids:
+                return None
+            row = self.ids.index(doc_id)
+            return {'document': self.docs[row], 'metadata': dict(self.doc_metadatas[row] or {})}
         try:
             result = self.collection.get(ids=[doc_id])
             if result['documents']:
@@ -83,7 +407,20 @@ class VectorDatabase:
     def delete_document(self, doc_id: str) -> bool:
         """Delete a document from the database"""
         try:
-            self.collection.delete(ids=[doc_id])
+            if self.collection is not None:
+                self.collection.delete(ids=[doc_id])
+            with self._mirror_lock:
+                self._flush_pending()  # so row numbers line up with self.ids
+                if doc_id in self.ids:
+                    row = self.ids.index(doc_id)
+                    self.emb_codes = np.delete(self.emb_codes, row, axis=0)
+                    self.emb_scales = np.delete(self.emb_scales, row)
+                    doc_hash = (self.doc_metadatas[row] or {}).get('doc_hash')
+                    if self._doc_hashes.get(doc_hash) == doc_id:
+                        del self._doc_hashes[doc_hash]
+                    self.ids = self.ids[:row] + self.ids[row + 1:]
+                    self.docs = self.docs[:row] + self.docs[row + 1:]
+                    self.doc_metadatas = self.doc_metadatas[:row] + self.doc_metadatas[row + 1:]
             return True
         except Exception as e:
             print(f"Error deleting document: {e}")
@@ -91,6 +428,9 @@ class VectorDatabase:
     
     def get_all_documents(self) -> List[Dict[str, Any]]:
         """Get all documents from the database"""
+        if self.collection is None:
+            return [{'id': chunk_id, 'document': doc, 'metadata': dict(metadata or {})}
+                    for chunk_id, doc, metadata in zip(self.ids, self.docs, self.doc_metadatas)]
         try:
             result = self.collection.get()
             documents = []
@@ -106,39 +446,22 @@ class VectorDatabase:
             return []
     
     def _split_text(self, text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
-        """Split text into overlapping chunks"""
+        """Split text into chunks of whole sentences, overlapping by up to `overlap` characters.
+
+        Strings are only sliced out of `text` for the chunks that are emitted;
+        see _chunk_spans for the offsets.
+        """
         if len(text) <= chunk_size:
             return [text]
-        
-        chunks = []
-        start = 0
-        
-        while start < len(text):
-            end = start + chunk_size
-            
-            # If not the last chunk, try to break at a sentence boundary
-            if end < len(text):
-                # Look for sentence endings
-                for i in range(end, max(start, end - 100), -1):
-                    if text[i] in '.!?':
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            # Move start position with overlap
-            start = end - overlap
-            if start >= len(text):
-                break
-        
-        return chunks
+        spans = _chunk_spans(text, chunk_size, overlap)
+        if not spans:
+            return [text]
+        return [text[start:end] for start, end in spans]
     
     def get_collection_stats(self) -> Dict[str, Any]:
         """Get statistics about the collection"""
         try:
-            count = self.collection.count()
+            count = len(self.ids) if self.collection is None else self.collection.count()
             return {
                 'total_documents': count,
                 'persist_directory': self.persist_directory
@@ -147,5 +470,11 @@ class VectorDatabase:
             print(f"Error getting collection stats: {e}")
             return {'total_documents': 0, 'persist_directory': self.persist_directory}
 
-# Global instance
-vector_db = VectorDatabase() 
\ No newline at end of file
+# Global instance, created on first use so importing this module doesn't load the model
+_vector_db: Optional[VectorDatabase] = None
+
+def get_vector_db() -> VectorDatabase:
+    global _vector_db
+    if _vector_db is None:
+        _vector_db = VectorDatabase()
+    return _vector_db